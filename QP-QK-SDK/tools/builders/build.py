@@ -12,19 +12,170 @@ import sys
 import argparse
 import subprocess
 import json
-import yaml
+import copy
+import hashlib
+import re
+import shlex
+import shutil
+import socket
+import threading
+import contextlib
+import io
+import itertools
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# PyYAML and its loader, imported on first use so JSON configs skip the cost
+_yaml = None
+_SafeLoader = None
+
+# Parsed config files: path -> (mtime, size, config), least recently used first
+_YAML_CACHE: 'OrderedDict[str, Tuple[float, int, Dict]]' = OrderedDict()
+_YAML_CACHE_MAX = 100
+
+# Build DBs as last written: path -> (file mtime, DB), reused by the daemon
+_BUILD_DB_CACHE: Dict[str, Tuple[int, Dict]] = {}
+
+# Default idle time before a build daemon exits, in minutes
+DAEMON_IDLE_TIMEOUT = 30
+
+# Glob results: (base, pattern) -> (directory mtime, matches)
+_GLOB_CACHE: Dict[Tuple[str, str], Tuple[int, List[Path]]] = {}
+
+# Sequence number making clean()'s trash directory names unique within a process
+_TRASH_COUNTER = itertools.count()
+
+
+def _load_yaml(f) -> Dict:
+    """Parse a YAML stream, importing PyYAML the first time it is needed"""
+    global _yaml, _SafeLoader
+    if _yaml is None:
+        import yaml
+        # Prefer the libyaml-backed loader, it is several times faster
+        _SafeLoader = getattr(yaml, 'CSafeLoader', None)
+        if _SafeLoader is None:
+            _SafeLoader = yaml.SafeLoader
+            print("WARNING: libyaml not available, using pure-Python YAML loader")
+        _yaml = yaml
+    return _yaml.load(f, Loader=_SafeLoader)
+
+
+def _load_config_file(config_file: Path) -> Dict:
+    """Parse a YAML/JSON config file, reusing the cached result if unchanged"""
+    st = config_file.stat()
+    key = str(config_file.resolve())
+    
+    entry = _YAML_CACHE.get(key)
+    if entry is not None and entry[0] == st.st_mtime and entry[1] == st.st_size:
+        _YAML_CACHE.move_to_end(key)
+        # Callers may mutate the config, so never hand out the cached dict
+        return copy.deepcopy(entry[2])
+    
+    with open(config_file, 'r') as f:
+        if config_file.suffix == '.json':
+            config = json.load(f)
+        else:
+            config = _load_yaml(f)
+    
+    _YAML_CACHE[key] = (st.st_mtime, st.st_size, config)
+    _YAML_CACHE.move_to_end(key)
+    if len(_YAML_CACHE) > _YAML_CACHE_MAX:
+        _YAML_CACHE.popitem(last=False)
+    
+    return copy.deepcopy(config)
+
+
+def _cached_glob(base: Path, pattern: str) -> List[Path]:
+    """Glob a pattern, rescanning only when its directory has changed"""
+    parent = Path(pattern).parent
+    directory = base / parent
+    
+    # Only single-directory patterns can be validated by one mtime
+    if '*' in str(parent) or not directory.is_dir():
+        return list(base.glob(pattern))
+    
+    key = (str(base.absolute()), pattern)
+    dir_mtime = directory.stat().st_mtime_ns
+    entry = _GLOB_CACHE.get(key)
+    if entry is not None and entry[0] == dir_mtime:
+        return list(entry[1])
+    
+    # Simple '*.ext' patterns need one scandir instead of a glob walk
+    name = Path(pattern).name
+    if name.startswith('*') and not any(c in name[1:] for c in '*?['):
+        with os.scandir(directory) as it:
+            matches = [directory / entry.name for entry in it
+                       if entry.name.endswith(name[1:]) and entry.is_file()]
+    else:
+        matches = list(base.glob(pattern))
+    _GLOB_CACHE[key] = (dir_mtime, matches)
+    return list(matches)
+
+
+def _run_quiet(cmd: List[str], cwd: Optional[Path] = None) -> subprocess.CompletedProcess:
+    """Run a tool discarding stdout and capturing stderr for error reports"""
+    # close_fds=False with an absolute executable lets CPython use posix_spawn
+    # instead of fork+exec (Python's own fds are non-inheritable anyway)
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True, close_fds=False, cwd=cwd)
+    _, stderr = proc.communicate()
+    return subprocess.CompletedProcess(cmd, proc.returncode, None, stderr)
+
+
+def _remove_trees(paths: List[Path]):
+    """Delete directory trees, ignoring errors (used from background threads)"""
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _ninja_path(path: Path) -> str:
+    """Escape a path for use in a Ninja build statement"""
+    return str(path).replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+def _ninja_command(args: List[str]) -> str:
+    """Quote arguments for a Ninja variable holding part of a shell command"""
+    return ' '.join(shlex.quote(arg) for arg in args).replace('$', '$$')
+
+
+def _parse_depfile(dep_file: Path) -> List[str]:
+    """Return the prerequisites listed in a make-style dependency file"""
+    text = dep_file.read_text().replace('\\\n', ' ')
+    parts = re.split(r':(?:\s|$)', text, maxsplit=1)
+    if len(parts) < 2:
+        return []
+    # Escaped spaces belong to the file name, not the separator
+    prereqs = parts[1].replace('\\ ', '\0').split()
+    return [p.replace('\0', ' ') for p in prereqs]
+
 
 class QKBuilder:
     """Automated build system for QP-QK projects"""
     
-    def __init__(self, project_root: str):
+    def __init__(self, project_root: str, jobs: Optional[int] = None,
+                 use_ccache: bool = True, staged: bool = False,
+                 use_ninja: bool = False):
         self.project_root = Path(project_root)
         self.build_dir = self.project_root / "build"
+        self.jobs = jobs or os.cpu_count() or 1
+        self.use_ccache = use_ccache
+        self.build_db_file = self.build_dir / ".build_db.json"
+        self._platform_flags: Optional[Dict] = None
+        self._include_dirs: Optional[List[str]] = None
+        self._defines: Optional[List[str]] = None
         self.config = self.load_build_config()
         self.toolchain = self.setup_toolchain()
+        self.cc_path = shutil.which(self.toolchain['cc']) or self.toolchain['cc']
+        self.staged = staged or self.config.get('staged_compile', False)
+        self.use_ninja = use_ninja or self.config.get('backend') == 'ninja'
+        self._digests: Dict[str, str] = {}
+        self._stats: Dict[str, List[int]] = {}
+        self._pp_digests: Dict[str, str] = {}
+        self._db_dirty = False
+        self.sweep_trash()
         
     def load_build_config(self) -> Dict:
         """Load build configuration from project"""
@@ -36,12 +187,7 @@ class QKBuilder:
         
         for config_file in config_files:
             if config_file.exists():
-                if config_file.suffix == '.yaml':
-                    with open(config_file, 'r') as f:
-                        return yaml.safe_load(f)
-                elif config_file.suffix == '.json':
-                    with open(config_file, 'r') as f:
-                        return json.load(f)
+                return _load_config_file(config_file)
         
         # Default configuration
         return {
@@ -64,6 +210,7 @@ class QKBuilder:
                 'objcopy': 'arm-none-eabi-objcopy',
                 'objdump': 'arm-none-eabi-objdump',
                 'size': 'arm-none-eabi-size',
+                'nm': 'arm-none-eabi-nm',
                 'gdb': 'arm-none-eabi-gdb'
             },
             'clang': {
@@ -72,15 +219,23 @@ class QKBuilder:
                 'objcopy': 'llvm-objcopy',
                 'objdump': 'llvm-objdump',
                 'size': 'llvm-size',
+                'nm': 'llvm-nm',
                 'gdb': 'gdb'
             }
         }
         
+        # Run the compiler through ccache when it is installed
+        ccache = shutil.which('ccache') if self.use_ccache else None
+        self.ccache_prefix = [ccache] if ccache else []
+        
         toolchain_name = self.config.get('toolchain', 'gcc-arm-none-eabi')
         return toolchain_configs.get(toolchain_name, toolchain_configs['gcc-arm-none-eabi'])
     
     def get_platform_flags(self) -> Dict:
         """Get platform-specific compiler flags"""
+        if self._platform_flags is not None:
+            return self._platform_flags
+        
         platform_flags = {
             'stm32f4': {
                 'cflags': [
@@ -130,7 +285,8 @@ class QKBuilder:
         }
         
         platform = self.config.get('platform', 'stm32f4')
-        return platform_flags.get(platform, platform_flags['stm32f4'])
+        self._platform_flags = platform_flags.get(platform, platform_flags['stm32f4'])
+        return self._platform_flags
     
     def collect_sources(self) -> List[Path]:
         """Collect all source files for compilation"""
@@ -141,7 +297,7 @@ class QKBuilder:
             pattern_path = self.project_root / pattern
             if '*' in pattern:
                 # Glob pattern
-                sources.extend(self.project_root.glob(pattern))
+                sources.extend(_cached_glob(self.project_root, pattern))
             else:
                 # Direct file
                 if pattern_path.exists():
@@ -152,14 +308,17 @@ class QKBuilder:
         if qp_path.exists():
             qp_src = qp_path / 'src'
             if qp_src.exists():
-                sources.extend(qp_src.glob('qf/*.c'))
-                sources.extend(qp_src.glob('qk/*.c'))  # QK kernel
-                sources.extend(qp_src.glob('qs/*.c'))   # QS tracing
+                sources.extend(_cached_glob(qp_src, 'qf/*.c'))
+                sources.extend(_cached_glob(qp_src, 'qk/*.c'))  # QK kernel
+                sources.extend(_cached_glob(qp_src, 'qs/*.c'))   # QS tracing
         
         return sources
     
     def get_include_dirs(self) -> List[str]:
         """Get include directories"""
+        if self._include_dirs is not None:
+            return self._include_dirs
+        
         includes = []
         
         # Project includes
@@ -167,21 +326,26 @@ class QKBuilder:
         for inc in project_includes:
             inc_path = self.project_root / inc
             if inc_path.exists():
-                includes.append(str(inc_path))
+                includes.append(str(inc_path.resolve()))
         
         # QP framework includes
         qp_path = Path(self.config.get('qp_path', '../qpc'))
         if qp_path.exists():
             includes.extend([
-                str(qp_path / 'include'),
-                str(qp_path / 'ports' / 'arm-cm' / 'qk' / 'gnu')
+                str((qp_path / 'include').resolve()),
+                str((qp_path / 'ports' / 'arm-cm' / 'qk' / 'gnu').resolve())
             ])
         
+        self._include_dirs = includes
         return includes
     
     def get_defines(self) -> List[str]:
         """Get preprocessor defines"""
-        defines = self.config.get('defines', [])
+        if self._defines is not None:
+            return self._defines
+        
+        # Copy so the config's own list is not extended on every call
+        defines = list(self.config.get('defines', []))
         
         # Add QP-specific defines
         defines.extend([
@@ -189,18 +353,11 @@ class QKBuilder:
             'Q_SPY=1' if self.config.get('debug', True) else 'Q_SPY=0'
         ])
         
+        self._defines = defines
         return defines
     
-    def build_objects(self, sources: List[Path]) -> List[Path]:
-        """Compile source files to object files"""
-        print("Compiling source files...")
-        
-        # Create build directory
-        self.build_dir.mkdir(exist_ok=True)
-        obj_dir = self.build_dir / "obj"
-        obj_dir.mkdir(exist_ok=True)
-        
-        objects = []
+    def get_cflags(self) -> List[str]:
+        """Get the compiler flags shared by every source file"""
         platform_flags = self.get_platform_flags()
         include_dirs = self.get_include_dirs()
         defines = self.get_defines()
@@ -210,7 +367,8 @@ class QKBuilder:
             f'-{self.config.get("optimization", "Os")}',
             '-Wall',
             '-Wextra',
-            '-std=c99'
+            '-std=c99',
+            '-MMD'  # Emit obj/<name>.d header dependencies
         ]
         
         if self.config.get('debug', True):
@@ -227,54 +385,302 @@ class QKBuilder:
         for define in defines:
             cflags.append(f'-D{define}')
         
-        # Compile each source file
+        return cflags
+    
+    def get_ldflags(self) -> List[str]:
+        """Get the linker flags, including the linker script"""
+        platform_flags = self.get_platform_flags()
+        ldflags = list(platform_flags['ldflags'])
+        
+        # Add linker script if specified
+        linker_script = self.project_root / platform_flags.get('linker_script', '')
+        if linker_script.exists():
+            ldflags.extend(['-T', str(linker_script)])
+        
+        return ldflags
+    
+    def build_objects(self, sources: List[Path]) -> List[Path]:
+        """Compile source files to object files"""
+        print("Compiling source files...")
+        
+        # Create build directory
+        self.build_dir.mkdir(exist_ok=True)
+        obj_dir = self.build_dir / "obj"
+        obj_dir.mkdir(exist_ok=True)
+        
+        objects = []
+        cflags = self.get_cflags()
+        
+        # Compiler command shared by every source
+        cmd_prefix = [*self.ccache_prefix, self.cc_path, *cflags, '-c']
+        
+        # Collect stale sources by comparing content hashes with the build DB
+        build_db = self.load_build_db()
+        cflags_hash = hashlib.sha256(
+            '\0'.join([self.toolchain['cc']] + cflags).encode()).hexdigest()
+        self._digests = {}
+        self._stats = {}
+        self._pp_digests = {}
+        self._db_dirty = False
+        
+        # Snapshot the object directory once instead of stat-ing every object
+        with os.scandir(obj_dir) as it:
+            existing_objects = {entry.name for entry in it if entry.name.endswith('.o')}
+        
+        stale = []
         for src in sources:
-            obj_file = obj_dir / f"{src.stem}.o"
+            obj_name = f"{src.stem}.o"
+            obj_file = obj_dir / obj_name
             objects.append(obj_file)
             
             # Check if compilation needed
-            if (not obj_file.exists() or 
-                src.stat().st_mtime > obj_file.stat().st_mtime):
-                
-                cmd = [self.toolchain['cc']] + cflags + ['-c', str(src), '-o', str(obj_file)]
-                
-                print(f"Compiling {src.name}...")
-                result = subprocess.run(cmd, capture_output=True, text=True)
+            entry = build_db.get(str(obj_file))
+            if not self.is_up_to_date(entry, src, obj_name in existing_objects, cflags_hash):
+                stale.append((src, obj_file))
+        
+        # Compile stale sources in parallel (compiler processes do the work)
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = {}
+                for batch in self.make_batches(stale):
+                    print(f"Compiling {', '.join(src.name for src, _ in batch)}...")
+                    if self.staged:
+                        src, obj_file = batch[0]
+                        future = executor.submit(self._compile_staged, src, obj_file, cflags,
+                                                 build_db.get(str(obj_file)), cflags_hash)
+                    else:
+                        future = executor.submit(self._compile_batch, batch, cmd_prefix)
+                    futures[future] = batch
                 
-                if result.returncode != 0:
-                    print(f"Error compiling {src.name}:")
-                    print(result.stderr)
-                    sys.exit(1)
+                for future in as_completed(futures):
+                    result = future.result()
+                    batch = futures[future]
+                    if result.returncode != 0:
+                        for pending in futures:
+                            pending.cancel()
+                        self.save_build_db(build_db)
+                        print(f"Error compiling {', '.join(src.name for src, _ in batch)}:")
+                        print(result.stderr)
+                        sys.exit(1)
+                    
+                    for src, obj_file in batch:
+                        build_db[str(obj_file)] = self.make_db_entry(src, obj_file, cflags_hash)
+                        self._db_dirty = True
+        
+        if self._db_dirty:
+            self.save_build_db(build_db)
         
         return objects
     
+    def load_build_db(self) -> Dict:
+        """Load the incremental build database"""
+        try:
+            # Reuse the in-memory copy while the file is the one we wrote
+            key = str(self.build_db_file.absolute())
+            entry = _BUILD_DB_CACHE.get(key)
+            if entry is not None and entry[0] == self.build_db_file.stat().st_mtime_ns:
+                return entry[1]
+            
+            with open(self.build_db_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_build_db(self, build_db: Dict):
+        """Atomically write the incremental build database"""
+        tmp_file = self.build_db_file.with_name(self.build_db_file.name + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(build_db, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.build_db_file)
+        
+        key = str(self.build_db_file.absolute())
+        _BUILD_DB_CACHE[key] = (self.build_db_file.stat().st_mtime_ns, build_db)
+    
+    def digest(self, path: Path) -> Optional[str]:
+        """SHA-256 of a file's contents, memoized for the current build"""
+        key = str(path)
+        if key not in self._digests:
+            try:
+                self._digests[key] = hashlib.sha256(path.read_bytes()).hexdigest()
+            except OSError:
+                self._digests[key] = None
+        return self._digests[key]
+    
+    def file_stat(self, path: Path) -> Optional[List[int]]:
+        """[mtime_ns, size] of a file, memoized for the current build"""
+        key = str(path)
+        if key not in self._stats:
+            try:
+                st = path.stat()
+                self._stats[key] = [st.st_mtime_ns, st.st_size]
+            except OSError:
+                self._stats[key] = None
+        return self._stats[key]
+    
+    def is_up_to_date(self, entry: Optional[Dict], src: Path, obj_exists: bool,
+                      cflags_hash: str) -> bool:
+        """Check whether an object matches its recorded source, flags and headers"""
+        if entry is None or entry.get('cflags_sha256') != cflags_hash:
+            return False
+        if not obj_exists:
+            return False
+        
+        # Only hash the source when its stat no longer matches the DB
+        src_stat = self.file_stat(src)
+        if [entry.get('src_mtime_ns'), entry.get('src_size')] != src_stat:
+            if entry.get('src_sha256') != self.digest(src):
+                return False
+            entry['src_mtime_ns'], entry['src_size'] = src_stat
+            self._db_dirty = True
+        
+        # Same for every header listed in the object's -MMD depfile
+        dep_stats = entry.setdefault('dep_stats', {})
+        for dep, dep_hash in entry.get('deps', {}).items():
+            dep_path = Path(dep)
+            dep_stat = self.file_stat(dep_path)
+            if dep_stat is None:
+                return False
+            if dep_stats.get(dep) != dep_stat:
+                if self.digest(dep_path) != dep_hash:
+                    return False
+                dep_stats[dep] = dep_stat
+                self._db_dirty = True
+        return True
+    
+    def make_db_entry(self, src: Path, obj_file: Path, cflags_hash: str) -> Dict:
+        """Build the database entry for a freshly compiled object"""
+        deps = {}
+        dep_stats = {}
+        dep_file = obj_file.with_suffix('.d')
+        if dep_file.exists():
+            src_path = src.resolve()
+            for dep in _parse_depfile(dep_file):
+                dep_path = Path(dep).resolve()
+                if dep_path != src_path:
+                    deps[str(dep_path)] = self.digest(dep_path)
+                    dep_stats[str(dep_path)] = self.file_stat(dep_path)
+        
+        src_mtime_ns, src_size = self.file_stat(src)
+        entry = {
+            'src_sha256': self.digest(src),
+            'src_mtime_ns': src_mtime_ns,
+            'src_size': src_size,
+            'cflags_sha256': cflags_hash,
+            'deps': deps,
+            'dep_stats': dep_stats
+        }
+        
+        if str(obj_file) in self._pp_digests:
+            entry['pp_sha256'] = self._pp_digests[str(obj_file)]
+        
+        return entry
+    
+    def make_batches(self, stale: List[Tuple[Path, Path]]) -> List[List[Tuple[Path, Path]]]:
+        """Split stale sources into one compiler invocation per job"""
+        # Staged compiles and ccache both work on single sources
+        if self.staged or self.ccache_prefix:
+            return [[item] for item in stale]
+        
+        # All sources share the same cflags, so group them round-robin
+        batch_count = min(self.jobs, len(stale))
+        return [stale[i::batch_count] for i in range(batch_count)]
+    
+    def _compile_batch(self, batch: List[Tuple[Path, Path]],
+                       cmd_prefix: List[str]) -> subprocess.CompletedProcess:
+        """Compile several sources with one compiler process"""
+        if len(batch) == 1:
+            return self._compile_one(batch[0][0], batch[0][1], cmd_prefix)
+        
+        # Without -o, gcc writes <stem>.o and <stem>.d into its working directory
+        obj_dir = batch[0][1].parent
+        cmd = [*cmd_prefix, *(str(src.resolve()) for src, _ in batch)]
+        return _run_quiet(cmd, cwd=obj_dir)
+    
+    def _compile_staged(self, src: Path, obj_file: Path, cflags: List[str],
+                        entry: Optional[Dict], cflags_hash: str) -> subprocess.CompletedProcess:
+        """Preprocess, compile and assemble a source as separately cached stages"""
+        pp_file = self.build_dir / "pp" / f"{src.stem}.i"
+        asm_file = self.build_dir / "asm" / f"{src.stem}.s"
+        pp_file.parent.mkdir(exist_ok=True)
+        asm_file.parent.mkdir(exist_ok=True)
+        
+        # Every stage gets the full flags: -O*, -g etc. also set predefined macros
+        compile_flags = [flag for flag in cflags if flag != '-MMD']
+        
+        # Preprocess, recording header dependencies for the object
+        cmd = ([self.cc_path] + compile_flags +
+               ['-MMD', '-MF', str(obj_file.with_suffix('.d')), '-MT', str(obj_file),
+                '-E', str(src), '-o', str(pp_file)])
+        result = _run_quiet(cmd)
+        if result.returncode != 0:
+            return result
+        
+        # An unchanged translation unit (e.g. comment-only edit) keeps its object
+        pp_hash = hashlib.sha256(pp_file.read_bytes()).hexdigest()
+        self._pp_digests[str(obj_file)] = pp_hash
+        if (entry is not None and entry.get('pp_sha256') == pp_hash and
+                entry.get('cflags_sha256') == cflags_hash and obj_file.exists()):
+            return result
+        
+        # Compile to assembly, then assemble
+        cc = [*self.ccache_prefix, self.cc_path]
+        for cmd in ([*cc, *compile_flags, '-S', str(pp_file), '-o', str(asm_file)],
+                    [*cc, *compile_flags, '-c', str(asm_file), '-o', str(obj_file)]):
+            result = _run_quiet(cmd)
+            if result.returncode != 0:
+                break
+        
+        return result
+    
+    def _compile_one(self, src: Path, obj_file: Path,
+                     cmd_prefix: List[str]) -> subprocess.CompletedProcess:
+        """Compile a single source file to an object file"""
+        cmd = [*cmd_prefix, str(src), '-o', str(obj_file)]
+        return _run_quiet(cmd)
+    
     def link_executable(self, objects: List[Path]) -> Path:
         """Link object files into executable"""
         print("Linking executable...")
         
-        platform_flags = self.get_platform_flags()
         output_elf = self.build_dir / f"{self.config.get('project_name', 'firmware')}.elf"
+        ldflags = self.get_ldflags()
         
-        # Linker flags
-        ldflags = platform_flags['ldflags']
+        # Skip the link when the objects and flags are bit-identical to last time
+        manifest_file = self.build_dir / ".link_manifest"
+        manifest = hashlib.sha256('\0'.join([self.toolchain['ld']] + ldflags).encode())
+        if '-T' in ldflags:
+            manifest.update(Path(ldflags[ldflags.index('-T') + 1]).read_bytes())
+        for obj in objects:
+            manifest.update(str(obj).encode())
+            manifest.update(hashlib.sha256(obj.read_bytes()).digest())
+        manifest_hash = manifest.hexdigest()
         
-        # Add linker script if specified
-        linker_script = self.project_root / platform_flags.get('linker_script', '')
-        if linker_script.exists():
-            ldflags.extend(['-T', str(linker_script)])
+        if (output_elf.exists() and manifest_file.exists() and
+                manifest_file.read_text().strip() == manifest_hash):
+            print("Executable up to date")
+            return output_elf
         
-        # Link command
+        # Link into a temporary file first
+        tmp_elf = output_elf.with_name(output_elf.name + '.tmp')
         cmd = ([self.toolchain['ld']] + ldflags + 
                [str(obj) for obj in objects] + 
-               ['-o', str(output_elf)])
+               ['-o', str(tmp_elf)])
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True)
         
         if result.returncode != 0:
             print("Error linking:")
             print(result.stderr)
             sys.exit(1)
         
+        # Keep the existing ELF (and its mtime) if the output is identical
+        if output_elf.exists() and output_elf.read_bytes() == tmp_elf.read_bytes():
+            tmp_elf.unlink()
+        else:
+            os.replace(tmp_elf, output_elf)
+        
+        manifest_file.write_text(manifest_hash + '\n')
         return output_elf
     
     def generate_binary(self, elf_file: Path) -> Dict[str, Path]:
@@ -284,24 +690,148 @@ class QKBuilder:
         outputs = {}
         base_name = elf_file.stem
         
-        # Generate .bin file
         bin_file = self.build_dir / f"{base_name}.bin"
-        cmd = [self.toolchain['objcopy'], '-O', 'binary', str(elf_file), str(bin_file)]
-        subprocess.run(cmd, check=True)
-        outputs['bin'] = bin_file
-        
-        # Generate .hex file
         hex_file = self.build_dir / f"{base_name}.hex"
-        cmd = [self.toolchain['objcopy'], '-O', 'ihex', str(elf_file), str(hex_file)]
-        subprocess.run(cmd, check=True)
-        outputs['hex'] = hex_file
-        
-        # Generate disassembly
         asm_file = self.build_dir / f"{base_name}.asm"
-        with open(asm_file, 'w') as f:
-            cmd = [self.toolchain['objdump'], '-d', str(elf_file)]
-            subprocess.run(cmd, stdout=f, check=True)
-        outputs['asm'] = asm_file
+        
+        # (output type, command without output, output path, write stdout to output)
+        stages = [
+            ('bin', [self.toolchain['objcopy'], '-O', 'binary', str(elf_file)],
+             bin_file, False),
+            ('hex', [self.toolchain['objcopy'], '-O', 'ihex', str(elf_file)],
+             hex_file, False),
+            ('asm', [self.toolchain['objdump'], '-d', str(elf_file)],
+             asm_file, True)
+        ]
+        
+        # Outputs newer than the ELF are already up to date
+        elf_mtime = elf_file.stat().st_mtime
+        pending = [(cmd, output, to_stdout) for _, cmd, output, to_stdout in stages
+                   if not (output.exists() and output.stat().st_mtime >= elf_mtime)]
+        
+        # The stages only read the ELF, so run them concurrently
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = [executor.submit(self._run_output_stage, cmd, output, to_stdout)
+                       for cmd, output, to_stdout in pending]
+            for future in futures:
+                future.result()
+        
+        for file_type, _, output, _ in stages:
+            outputs[file_type] = output
+        
+        return outputs
+    
+    def _run_output_stage(self, cmd: List[str], output: Path, to_stdout: bool):
+        """Run one binary generation tool, raising on failure"""
+        # Write to a temporary file and move it into place only on success, so a
+        # failed stage never leaves a partial output newer than the ELF
+        tmp_output = output.with_name(output.name + '.tmp')
+        try:
+            if to_stdout:
+                with open(tmp_output, 'wb') as f:
+                    result = subprocess.run(cmd, stdout=f, stderr=subprocess.PIPE, text=True)
+            else:
+                result = _run_quiet(cmd + [str(tmp_output)])
+            
+            # Printed rather than inherited so daemon clients see the diagnostics;
+            # one print per error, as the stages run concurrently
+            if result.returncode != 0:
+                print(f"Error generating {output.name}:\n{result.stderr}")
+                raise subprocess.CalledProcessError(result.returncode, result.args)
+            os.replace(tmp_output, output)
+        finally:
+            tmp_output.unlink(missing_ok=True)
+    
+    def emit_ninja(self, sources: List[Path]) -> Dict[str, Path]:
+        """Write build/build.ninja for the project and return its outputs"""
+        self.build_dir.mkdir(exist_ok=True)
+        obj_dir = self.build_dir / "obj"
+        ninja_file = self.build_dir / "build.ninja"
+        
+        base_name = self.config.get('project_name', 'firmware')
+        elf_file = self.build_dir / f"{base_name}.elf"
+        outputs = {
+            'bin': self.build_dir / f"{base_name}.bin",
+            'hex': self.build_dir / f"{base_name}.hex",
+            'asm': self.build_dir / f"{base_name}.asm"
+        }
+        
+        # Ninja runs Windows commands without a shell, so redirect through cmd there
+        if os.name == 'nt':
+            objdump_command = "cmd /c $objdump -d $in > $out.tmp && move /y $out.tmp $out > nul"
+        else:
+            objdump_command = "$objdump -d $in > $out.tmp && mv -f $out.tmp $out"
+        
+        # Relink when the linker script changes, like the .link_manifest check
+        ldflags = self.get_ldflags()
+        link_deps = ""
+        if '-T' in ldflags:
+            link_deps = f" | {_ninja_path(Path(ldflags[ldflags.index('-T') + 1]))}"
+        
+        lines = [
+            f"builddir = {_ninja_path(self.build_dir)}",
+            f"cc = {_ninja_command(self.ccache_prefix + [self.toolchain['cc']])}",
+            f"ld = {_ninja_command([self.toolchain['ld']])}",
+            f"objcopy = {_ninja_command([self.toolchain['objcopy']])}",
+            f"objdump = {_ninja_command([self.toolchain['objdump']])}",
+            f"cflags = {_ninja_command(self.get_cflags())}",
+            f"ldflags = {_ninja_command(ldflags)}",
+            "",
+            "rule cc",
+            "  command = $cc $cflags -MF $out.d -c $in -o $out",
+            "  depfile = $out.d",
+            "  deps = gcc",
+            "  description = CC $in",
+            "",
+            "rule link",
+            "  command = $ld $ldflags $in -o $out",
+            "  description = LINK $out",
+            "",
+            "rule objcopy_bin",
+            "  command = $objcopy -O binary $in $out",
+            "",
+            "rule objcopy_hex",
+            "  command = $objcopy -O ihex $in $out",
+            "",
+            "rule objdump",
+            f"  command = {objdump_command}",
+            ""
+        ]
+        
+        objects = []
+        for src in sources:
+            obj_file = obj_dir / f"{src.stem}.o"
+            objects.append(_ninja_path(obj_file))
+            lines.append(f"build {_ninja_path(obj_file)}: cc {_ninja_path(src)}")
+        
+        lines.append(f"build {_ninja_path(elf_file)}: link {' '.join(objects)}{link_deps}")
+        for file_type, rule in (('bin', 'objcopy_bin'), ('hex', 'objcopy_hex'),
+                                ('asm', 'objdump')):
+            lines.append(f"build {_ninja_path(outputs[file_type])}: {rule} {_ninja_path(elf_file)}")
+        lines.append("")
+        
+        # Leave the file alone when unchanged so Ninja does not reload it
+        content = '\n'.join(lines)
+        if not ninja_file.exists() or ninja_file.read_text() != content:
+            ninja_file.write_text(content)
+        
+        outputs['elf'] = elf_file
+        return outputs
+    
+    def build_with_ninja(self, sources: List[Path]) -> Dict[str, Path]:
+        """Compile, link and generate binaries by delegating to Ninja"""
+        print("Building with ninja...")
+        
+        outputs = self.emit_ninja(sources)
+        cmd = ['ninja', '-f', str(self.build_dir / "build.ninja"), '-j', str(self.jobs)]
+        
+        # Relay Ninja's output through print so daemon clients see it too
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True) as proc:
+            for line in proc.stdout:
+                print(line, end='')
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
         
         return outputs
     
@@ -310,16 +840,30 @@ class QKBuilder:
         print("Analyzing memory usage...")
         
         cmd = [self.toolchain['size'], '-A', str(elf_file)]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print("\nMemory Usage:")
-            print(result.stdout)
         
-        # Save size report
+        # Stream the report to the console and the size report file, which is only
+        # written if size succeeds (the header too, as before streaming)
         size_file = self.build_dir / "size_report.txt"
-        with open(size_file, 'w') as f:
-            f.write(result.stdout)
+        tmp_file = size_file.with_name(size_file.name + '.tmp')
+        header_printed = False
+        with open(tmp_file, 'w') as f:
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  text=True) as proc:
+                for line in proc.stdout:
+                    if not header_printed:
+                        print("\nMemory Usage:")
+                        header_printed = True
+                    print(line, end='')
+                    f.write(line)
+                errors = proc.stderr.read()
+        
+        if proc.returncode != 0:
+            tmp_file.unlink()
+            size_file.unlink(missing_ok=True)  # Don't leave a stale report behind
+            print(f"Error analyzing size (exit code {proc.returncode}):")
+            print(errors)
+            return
+        os.replace(tmp_file, size_file)
     
     def validate_build(self, elf_file: Path) -> bool:
         """Validate the built firmware"""
@@ -337,24 +881,28 @@ class QKBuilder:
             print(f"WARNING: ELF file size ({file_size} bytes) seems very small")
             validation_passed = False
         
-        # Check for required symbols (QP framework)
-        cmd = [self.toolchain['objdump'], '-t', str(elf_file)]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
+        # Check for required symbols (QP framework) and QK kernel symbols
         required_symbols = ['QF_init', 'QF_run', 'QActive_start']
-        missing_symbols = []
+        qk_symbols = ['QK_sched_', 'QK_activate_']
+        
+        # Exact names of defined symbols (substring checks matched e.g. QF_init_hook).
+        # POSIX format puts the name first; just-symbols needs binutils >= 2.37.
+        cmd = [self.toolchain['nm'], '--defined-only', '--format=posix', str(elf_file)]
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              text=True) as proc:
+            defined = {line.split(maxsplit=1)[0] for line in proc.stdout if line.strip()}
+            nm_errors = proc.stderr.read().strip()
         
-        for symbol in required_symbols:
-            if symbol not in result.stdout:
-                missing_symbols.append(symbol)
+        if proc.returncode != 0:
+            print(f"ERROR: Symbol check failed (nm exit code {proc.returncode}): {nm_errors}")
+            return False
         
+        missing_symbols = [sym for sym in required_symbols if sym not in defined]
         if missing_symbols:
             print(f"ERROR: Missing required symbols: {missing_symbols}")
             validation_passed = False
         
-        # Check for QK kernel symbols
-        qk_symbols = ['QK_sched_', 'QK_activate_']
-        qk_found = any(sym in result.stdout for sym in qk_symbols)
+        qk_found = bool(defined & set(qk_symbols))
         if not qk_found:
             print("WARNING: QK kernel symbols not found - ensure QK is linked")
         
@@ -374,15 +922,20 @@ class QKBuilder:
             sources = self.collect_sources()
             print(f"Found {len(sources)} source files")
             
-            # Compile
-            objects = self.build_objects(sources)
-            
-            # Link
-            elf_file = self.link_executable(objects)
-            
-            # Generate binaries
-            outputs = self.generate_binary(elf_file)
-            outputs['elf'] = elf_file
+            if self.use_ninja:
+                # Compile, link and generate binaries in one Ninja run
+                outputs = self.build_with_ninja(sources)
+                elf_file = outputs['elf']
+            else:
+                # Compile
+                objects = self.build_objects(sources)
+                
+                # Link
+                elf_file = self.link_executable(objects)
+                
+                # Generate binaries
+                outputs = self.generate_binary(elf_file)
+                outputs['elf'] = elf_file
             
             # Analyze size
             self.analyze_size(elf_file)
@@ -412,18 +965,163 @@ class QKBuilder:
                 'build_time': time.time() - start_time
             }
     
+    def sweep_trash(self):
+        """Delete build directories left over by an interrupted clean"""
+        trash_dirs = list(self.project_root.glob('.build.trash.*'))
+        if trash_dirs:
+            threading.Thread(target=_remove_trees, args=(trash_dirs,),
+                             daemon=True).start()
+    
     def clean(self):
         """Clean build artifacts"""
         print("Cleaning build artifacts...")
         
         if self.build_dir.exists():
-            import shutil
-            shutil.rmtree(self.build_dir)
+            # Renaming is instant; the actual delete happens in the background
+            # Unique even for back-to-back cleans in one process (the daemon)
+            trash = self.build_dir.with_name(
+                f'.build.trash.{os.getpid()}.{time.time_ns()}.{next(_TRASH_COUNTER)}')
+            self.build_dir.rename(trash)
+            threading.Thread(target=shutil.rmtree, args=(trash,),
+                             kwargs={'ignore_errors': True}, daemon=True).start()
             print("Build directory cleaned")
         else:
             print("Build directory already clean")
 
 
+class _DaemonOutput(io.TextIOBase):
+    """stdout replacement that forwards printed text to a daemon client"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def write(self, text: str) -> int:
+        if text:
+            self.stream.write(json.dumps({'out': text}) + '\n')
+            self.stream.flush()
+        return len(text)
+
+
+def daemon_socket_path(project_root: str) -> Path:
+    """Socket of a project's build daemon (outside build/ so clean keeps it)"""
+    return Path(project_root).absolute() / ".qkbuild.sock"
+
+
+def handle_daemon_request(conn: socket.socket, project_root: str, builder_options: Dict):
+    """Run one client request, streaming its output back over the connection"""
+    with conn, conn.makefile('rw', encoding='utf-8') as stream:
+        line = stream.readline()
+        if not line:
+            return  # Liveness check from another daemon, nothing to run
+        request = json.loads(line)
+        result = {'success': True}
+        # Builder flags given to the client override the daemon's own
+        options = dict(builder_options)
+        options.update((key, value) for key, value in request.get('options', {}).items()
+                       if key in builder_options)
+        
+        with contextlib.redirect_stdout(_DaemonOutput(stream)):
+            try:
+                # Builders are cheap to create: config, globs and build DB stay cached
+                builder = QKBuilder(project_root, **options)
+                if request.get('clean'):
+                    builder.clean()
+                if request.get('build', True):
+                    result = builder.build(request.get('config', 'release'))
+            except SystemExit as e:
+                result = {'success': not e.code, 'error': f'Build exited with status {e.code}'}
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+        
+        stream.write(json.dumps({'result': {
+            'success': result['success'],
+            'error': result.get('error'),
+            'build_time': result.get('build_time')
+        }}) + '\n')
+
+
+def serve_daemon(project_root: str, builder_options: Dict,
+                 idle_timeout: float = DAEMON_IDLE_TIMEOUT):
+    """Serve build requests for a project until idle for idle_timeout minutes"""
+    sock_path = daemon_socket_path(project_root)
+    if sock_path.exists():
+        # Only replace the socket if no daemon is answering on it
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(sock_path))
+        except OSError:
+            sock_path.unlink()
+        else:
+            print(f"Build daemon already running on {sock_path}")
+            sys.exit(1)
+        finally:
+            probe.close()
+    
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(sock_path))
+    server.listen()
+    server.settimeout(idle_timeout * 60)
+    print(f"Build daemon listening on {sock_path}")
+    
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                print("Build daemon idle, exiting")
+                break
+            
+            conn.settimeout(None)
+            try:
+                handle_daemon_request(conn, project_root, builder_options)
+            except (OSError, ValueError) as e:
+                print(f"Error handling daemon request: {e}")
+    finally:
+        server.close()
+        if sock_path.exists():
+            sock_path.unlink()
+
+
+def run_client(project_root: str, request: Dict) -> Dict:
+    """Send a request to the project's build daemon and stream its output"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(str(daemon_socket_path(project_root)))
+    
+    with client, client.makefile('rw', encoding='utf-8') as stream:
+        stream.write(json.dumps(request) + '\n')
+        stream.flush()
+        
+        for line in stream:
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+            elif 'result' in message:
+                return message['result']
+    
+    return {'success': False, 'error': 'Build daemon closed the connection'}
+
+
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value!r}")
+    return count
+
+
+def _builder_options(args: argparse.Namespace) -> Dict:
+    """QKBuilder keyword arguments selected by the command line"""
+    return {
+        'jobs': args.jobs,
+        'use_ccache': not args.no_ccache,
+        'staged': args.staged,
+        'use_ninja': args.ninja
+    }
+
+
 def main():
     parser = argparse.ArgumentParser(description='QP-QK SDK Build Tool')
     parser.add_argument('--project', '-p', default='.', 
@@ -436,12 +1134,54 @@ def main():
                        help='Only clean, do not build')
     parser.add_argument('--verbose', '-v', action='store_true',
                        help='Verbose output')
+    parser.add_argument('--jobs', '-j', type=_positive_int, default=None,
+                       help='Parallel compile jobs (default: CPU count)')
+    parser.add_argument('--no-ccache', action='store_true',
+                       help='Do not use ccache even if it is installed')
+    parser.add_argument('--staged', action='store_true',
+                       help='Cache preprocess/compile/assemble stages separately')
+    parser.add_argument('--ninja', action='store_true',
+                       help='Generate build/build.ninja and build with ninja')
+    parser.add_argument('--daemon', action='store_true',
+                       help='Run a build daemon serving --client requests')
+    parser.add_argument('--client', action='store_true',
+                       help='Send the build to a running daemon')
+    parser.add_argument('--idle-timeout', type=float, default=DAEMON_IDLE_TIMEOUT,
+                       help=f'Daemon idle timeout in minutes (default: {DAEMON_IDLE_TIMEOUT})')
     
     args = parser.parse_args()
+    builder_options = _builder_options(args)
+    
+    if (args.daemon or args.client) and not hasattr(socket, 'AF_UNIX'):
+        print("Build daemon requires Unix domain sockets")
+        sys.exit(1)
+    
+    if args.daemon:
+        serve_daemon(args.project, builder_options, args.idle_timeout)
+        return
+    
+    if args.client:
+        default_options = _builder_options(parser.parse_args([]))
+        request = {
+            'clean': args.clean or args.clean_only,
+            'build': not args.clean_only,
+            'config': args.config,
+            # Only flags given on this command line, the rest keep the daemon's settings
+            'options': {key: value for key, value in builder_options.items()
+                        if value != default_options[key]}
+        }
+        try:
+            result = run_client(args.project, request)
+        except OSError as e:
+            print(f"Build daemon not available ({e}), building locally")
+        else:
+            if not result['success']:
+                sys.exit(1)
+            return
     
     # Create builder
     try:
-        builder = QKBuilder(args.project)
+        builder = QKBuilder(args.project, **builder_options)
     except Exception as e:
         print(f"Error initializing builder: {e}")
         sys.exit(1)
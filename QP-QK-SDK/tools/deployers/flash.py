@@ -12,18 +12,293 @@ import sys
 import argparse
 import subprocess
 import json
+import hashlib
+import mmap
+import re
+import shlex
+import shutil
+import threading
 import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# One match per probe in probe/enumeration output: serial plus optional description
+_ST_INFO_PARSER = re.compile(
+    r'serial:\s*(?P<serial>\S+)(?:(?:(?!serial:).)*?descr:\s*(?P<descr>[^\n]+))?', re.S)
+_PROBE_PARSERS = {
+    'stlink': _ST_INFO_PARSER,
+    'openocd': _ST_INFO_PARSER,
+    'jlink': re.compile(r'Serial number:\s*(?P<serial>\d+)(?:,\s*ProductName:\s*(?P<descr>[^\n,]+))?'),
+    'dfu': re.compile(r'(?:name="(?P<descr>[^"]*)",\s*)?serial="(?P<serial>[^"]+)"'),
+    'esp32': re.compile(r'Chip is (?P<descr>[^\n]+?)\s*\n.*?MAC:\s*(?P<serial>[0-9a-f:]{17})', re.S),
+    'msp430': re.compile(r'^\s*\S+\s+\S+\s+(?P<descr>.*?)\s*\[serial:\s*(?P<serial>[^\]\s]+)\]', re.M)
+}
+
+# SWD clock (kHz) used when programmer_speed is 'auto'
+_DEFAULT_SPEEDS_KHZ = {
+    'stlink': 4000,
+    'openocd': 8000,
+    'jlink': 4000
+}
+
+# Interfaces whose flash session also performs the requested erase
+_ERASE_INTEGRATED = {
+    'stlink': False,
+    'openocd': True,   # erase_sector in the same OpenOCD session
+    'jlink': True,     # erase in the same J-Link script
+    'dfu': False,
+    'esp32': False,
+    'msp430': True     # mspdebug prog erases first
+}
+
+# Interfaces whose flash session also performs the reset afterwards
+_RESET_INTEGRATED = ('stlink', 'openocd', 'jlink', 'esp32')
+
+# Programming tool commands and capabilities per interface
+_INTERFACE_CONFIGS = {
+    'stlink': {
+        'tool': 'st-flash',
+        'probe_cmd': ['st-info', '--probe'],
+        'flash_cmd': ['st-flash', 'write'],
+        'erase_cmd': ['st-flash', 'erase'],
+        'reset_cmd': ['st-flash', 'reset'],
+        'supported_targets': ['stm32f0', 'stm32f1', 'stm32f2', 'stm32f3', 'stm32f4', 'stm32f7', 'stm32h7', 'stm32l0', 'stm32l1', 'stm32l4']
+    },
+    
+    'jlink': {
+        'tool': 'JLinkExe',
+        'probe_cmd': ['JLinkExe'],
+        'probe_script': 'ShowEmuList\nexit\n',
+        'flash_cmd': ['JLinkExe'],
+        'erase_cmd': ['JLinkExe'],
+        'reset_cmd': ['JLinkExe'],
+        'supported_targets': ['stm32f4', 'stm32f7', 'stm32h7', 'nrf52', 'esp32']
+    },
+    
+    'openocd': {
+        'tool': 'openocd',
+        'probe_cmd': ['openocd', '-c', 'gdb_port disabled; tcl_port disabled; telnet_port disabled', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg', '-c', 'init; halt; exit'],
+        'flash_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg'],
+        'erase_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg'],
+        'reset_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg'],
+        'supported_targets': ['stm32f0', 'stm32f1', 'stm32f2', 'stm32f3', 'stm32f4', 'stm32f7', 'stm32h7', 'stm32l0', 'stm32l1', 'stm32l4', 'nrf52', 'esp32']
+    },
+    
+    'dfu': {
+        'tool': 'dfu-util',
+        'probe_cmd': ['dfu-util', '-l'],
+        'flash_cmd': ['dfu-util', '-a', '0', '-s'],
+        'erase_cmd': ['dfu-util', '-a', '0', '-s', '0x08000000:mass-erase:force'],
+        'reset_cmd': ['dfu-util', '-a', '0', '-s', '0x08000000:leave'],
+        'supported_targets': ['stm32f0', 'stm32f1', 'stm32f2', 'stm32f3', 'stm32f4', 'stm32f7', 'stm32h7', 'stm32l0', 'stm32l1', 'stm32l4']
+    },
+    
+    'esp32': {
+        'tool': 'esptool.py',
+        'probe_cmd': ['esptool.py', 'chip_id'],
+        'flash_cmd': ['esptool.py', '--chip', 'esp32', '--baud', '921600', 'write_flash'],
+        'erase_cmd': ['esptool.py', '--chip', 'esp32', 'erase_flash'],
+        'reset_cmd': ['esptool.py', '--chip', 'esp32', 'run'],
+        'supported_targets': ['esp32', 'esp32s2', 'esp32s3', 'esp32c3']
+    },
+    
+    'msp430': {
+        'tool': 'mspdebug',
+        'probe_cmd': ['mspdebug', 'rf2500', 'exit'],
+        'flash_cmd': ['mspdebug', 'rf2500', 'prog'],
+        'erase_cmd': ['mspdebug', 'rf2500', 'erase'],
+        'reset_cmd': ['mspdebug', 'rf2500', 'reset'],
+        'supported_targets': ['msp430g2553', 'msp430f5529', 'msp430fr5969']
+    }
+}
+
+# Tool output lines that are progress updates (esptool, dfu-util, J-Link, OpenOCD)
+_PROGRESS_LINE = re.compile(r'\d+(?:\.\d+)?\s*%')
+_PROGRESS_INTERVAL = 0.2
+
+# Option each tool uses to select one probe (or port) by serial
+_SERIAL_OPTIONS = {
+    'stlink': '--serial',
+    'jlink': '-USB',
+    'dfu': '-S',
+    'msp430': '-s'
+}
+
+# Fixed command prefixes, immutable so concurrent flashes can share them
+_DFU_BASE = ('dfu-util', '-a', '0')
+_ESPTOOL_BEFORE = ('--before', 'default_reset')
+_ESP32_WRITE = ('write_flash', '-z', '0x1000')
+
+# Default time budgets (seconds) per operation; flash grows with image size
+_TIMEOUTS = {
+    'probe': 10,
+    'erase': 60,
+    'reset': 5,
+    'flash': 30
+}
+
+# Resolved tool paths (None if not on PATH), looked up once per process
+_TOOL_PATHS: Dict[str, Optional[str]] = {}
+
+# Launch options for every tool process. With close_fds=False and an absolute
+# executable, CPython uses posix_spawn instead of fork+exec (Python's own fds
+# are non-inheritable anyway); on Windows, skip allocating a console window.
+_SPAWN_OPTIONS = {'close_fds': False}
+if os.name == 'nt':
+    _SPAWN_OPTIONS['creationflags'] = subprocess.CREATE_NO_WINDOW
+
+# Targets whose SWD ports run reliably at J-Link's 10+ MHz
+_FAST_JLINK_TARGETS = ('stm32f7', 'stm32h7', 'nrf52')
+
+def _parse_probes(interface: str, output: str) -> List[Dict[str, str]]:
+    """Extract [{'serial': ..., 'descr': ...}] from a tool's probe output, one per probe"""
+    parser = _PROBE_PARSERS.get(interface)
+    if parser is None:
+        return []
+    
+    # Tools like dfu-util list a device once per alt setting; keep the first
+    probes = {}
+    for match in parser.finditer(output):
+        probe = {key: value.strip() for key, value in match.groupdict().items() if value}
+        probes.setdefault(probe['serial'], probe)
+    return list(probes.values())
+
+def _tool_path(tool: str) -> Optional[str]:
+    """Absolute path of a tool on PATH (cached), or None"""
+    if tool not in _TOOL_PATHS:
+        _TOOL_PATHS[tool] = shutil.which(tool)
+    return _TOOL_PATHS[tool]
+
+def _resolve(cmd: Sequence[str]) -> Tuple[str, ...]:
+    """Command with its executable resolved to an absolute path when possible"""
+    return (_tool_path(cmd[0]) or cmd[0], *cmd[1:])
+
+def _select_probe(interface: str, serial: Optional[str]) -> Tuple[str, ...]:
+    """Command-line arguments selecting the probe with this serial, if any"""
+    return (_SERIAL_OPTIONS[interface], serial) if serial else ()
+
+def _run_streamed(cmd: Sequence[str], prefix: str = '', timeout: Optional[float] = None,
+                  script: Optional[str] = None) -> Tuple[int, str]:
+    """Run a tool, echoing its output as it arrives; return (returncode, output)"""
+    proc = subprocess.Popen(_resolve(cmd), stdin=subprocess.PIPE if script is not None else None,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            bufsize=1, text=True, **_SPAWN_OPTIONS)
+    if script is not None:
+        # Command scripts are a few hundred bytes, well under the pipe buffer
+        proc.stdin.write(script)
+        proc.stdin.close()
+    
+    expired = threading.Event()
+    
+    def expire():
+        expired.set()
+        proc.kill()
+    
+    timer = threading.Timer(timeout, expire) if timeout else None
+    if timer:
+        timer.start()
+    
+    # Progress updates are throttled, and redrawn in place on a terminal unless
+    # several devices are interleaving their output
+    progress_end = '\r' if sys.stdout.isatty() and not prefix else '\n'
+    progress_shown = 0.0
+    pending = None
+    
+    lines = []
+    try:
+        for line in proc.stdout:
+            lines.append(line)
+            if _PROGRESS_LINE.search(line):
+                now = time.monotonic()
+                if now - progress_shown < _PROGRESS_INTERVAL:
+                    pending = line
+                    continue
+                print(prefix + line.rstrip('\n'), end=progress_end, flush=True)
+                progress_shown, pending = now, None
+                continue
+            
+            # Show the final progress state before moving on
+            if pending:
+                print(prefix + pending.rstrip('\n'), end=progress_end)
+            if progress_shown and progress_end == '\r':
+                print()
+            progress_shown, pending = 0.0, None
+            print(prefix + line, end='')
+        
+        if pending:
+            print(prefix + pending.rstrip('\n'), end=progress_end)
+        if progress_shown and progress_end == '\r':
+            print()
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        proc.stdout.close()
+    
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, output=''.join(lines))
+    return proc.returncode, ''.join(lines)
+
+def _size_kb(size) -> Optional[float]:
+    """Convert a size like '512K', '2M', '0x80000' or a byte count to kilobytes"""
+    text = str(size).strip().upper()
+    try:
+        if text.startswith('0X'):
+            return int(text, 0) / 1024
+        text = text.rstrip('B')
+        if text.endswith('K'):
+            return float(text[:-1])
+        if text.endswith('M'):
+            return float(text[:-1]) * 1024
+        return int(text, 0) / 1024
+    except ValueError:
+        return None
+
+def _speed_khz(speed) -> Optional[int]:
+    """Convert a clock speed like 4000, '4000k' or '4 MHz' to kHz (bare numbers are kHz)"""
+    text = str(speed).replace(' ', '').upper()
+    scale = 1.0
+    if text.endswith('HZ'):
+        text, scale = text[:-2], 0.001
+    if text.endswith('K'):
+        text, scale = text[:-1], 1.0
+    elif text.endswith('M'):
+        text, scale = text[:-1], 1000.0
+    try:
+        khz = round(float(text) * scale)
+    except (ValueError, OverflowError):
+        return None
+    return khz if khz > 0 else None
+
+def _file_sha256(path: Path) -> str:
+    """SHA-256 of a file, hashed straight from a read-only mapping"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.sha256(data).hexdigest()
 
 class QKFlasher:
     """Automated flash and deployment system for QP-QK projects"""
     
-    def __init__(self, project_root: str):
+    def __init__(self, project_root: str, interface: Optional[str] = None):
         self.project_root = Path(project_root)
         self.build_dir = self.project_root / "build"
         self.config = self.load_flash_config()
         
+        # Recent successful probe results: interface -> (monotonic time, result)
+        self._probe_cache: Dict[str, tuple] = {}
+        self._probe_lock = threading.Lock()
+        
+        # Start probing in the background; the first probe_target() call for that
+        # interface consumes the result (found or not) instead of probing again
+        self._prefetched: Dict[str, Future] = {}
+        if self.config.get('prefetch_probe', True):
+            prefetch = interface or self.config.get('interface', 'stlink')
+            self._prefetched[prefetch] = Future()
+            threading.Thread(target=self._prefetch_probe, args=(prefetch,), daemon=True).start()
+        
     def load_flash_config(self) -> Dict:
         """Load flash configuration from project"""
         config_file = self.project_root / "flash_config.json"
@@ -42,438 +317,462 @@ class QKFlasher:
             'ram_size': '128K',
             'programmer_speed': 'auto',
             'reset_after_flash': True,
-            'verify_after_flash': True
+            'verify_after_flash': True,
+            'connect_under_reset': True
         }
     
     def get_interface_config(self, interface: str) -> Dict:
         """Get configuration for specific programming interface"""
-        
-        interface_configs = {
-            'stlink': {
-                'tool': 'st-flash',
-                'probe_cmd': ['st-info', '--probe'],
-                'flash_cmd': ['st-flash', 'write'],
-                'erase_cmd': ['st-flash', 'erase'],
-                'reset_cmd': ['st-flash', 'reset'],
-                'supported_targets': ['stm32f0', 'stm32f1', 'stm32f2', 'stm32f3', 'stm32f4', 'stm32f7', 'stm32h7', 'stm32l0', 'stm32l1', 'stm32l4']
-            },
-            
-            'jlink': {
-                'tool': 'JLinkExe',
-                'probe_cmd': ['JLinkExe', '-CommanderScript', 'probe.jlink'],
-                'flash_cmd': ['JLinkExe', '-CommanderScript'],
-                'erase_cmd': ['JLinkExe', '-CommanderScript'],
-                'reset_cmd': ['JLinkExe', '-CommanderScript'],
-                'supported_targets': ['stm32f4', 'stm32f7', 'stm32h7', 'nrf52', 'esp32']
-            },
-            
-            'openocd': {
-                'tool': 'openocd',
-                'probe_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg', '-c', 'init; halt; exit'],
-                'flash_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg'],
-                'erase_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg'],
-                'reset_cmd': ['openocd', '-f', 'interface/stlink.cfg', '-f', 'target/stm32f4x.cfg'],
-                'supported_targets': ['stm32f0', 'stm32f1', 'stm32f2', 'stm32f3', 'stm32f4', 'stm32f7', 'stm32h7', 'stm32l0', 'stm32l1', 'stm32l4', 'nrf52', 'esp32']
-            },
-            
-            'dfu': {
-                'tool': 'dfu-util',
-                'probe_cmd': ['dfu-util', '-l'],
-                'flash_cmd': ['dfu-util', '-a', '0', '-s'],
-                'erase_cmd': ['dfu-util', '-a', '0', '-s', '0x08000000:mass-erase:force'],
-                'reset_cmd': ['dfu-util', '-a', '0', '-s', '0x08000000:leave'],
-                'supported_targets': ['stm32f0', 'stm32f1', 'stm32f2', 'stm32f3', 'stm32f4', 'stm32f7', 'stm32h7', 'stm32l0', 'stm32l1', 'stm32l4']
-            },
-            
-            'esp32': {
-                'tool': 'esptool.py',
-                'probe_cmd': ['esptool.py', 'chip_id'],
-                'flash_cmd': ['esptool.py', '--chip', 'esp32', '--baud', '921600', 'write_flash'],
-                'erase_cmd': ['esptool.py', '--chip', 'esp32', 'erase_flash'],
-                'reset_cmd': ['esptool.py', '--chip', 'esp32', 'run'],
-                'supported_targets': ['esp32', 'esp32s2', 'esp32s3', 'esp32c3']
-            },
-            
-            'msp430': {
-                'tool': 'mspdebug',
-                'probe_cmd': ['mspdebug', 'rf2500', 'exit'],
-                'flash_cmd': ['mspdebug', 'rf2500', 'prog'],
-                'erase_cmd': ['mspdebug', 'rf2500', 'erase'],
-                'reset_cmd': ['mspdebug', 'rf2500', 'reset'],
-                'supported_targets': ['msp430g2553', 'msp430f5529', 'msp430fr5969']
-            }
-        }
-        
-        return interface_configs.get(interface, interface_configs['stlink'])
+        return _INTERFACE_CONFIGS.get(interface, _INTERFACE_CONFIGS['stlink'])
+    
+    def get_programmer_speed(self, interface: str) -> int:
+        """Get programmer clock speed in kHz for interface"""
+        speed = self.config.get('programmer_speed', 'auto')
+        if speed != 'auto':
+            khz = _speed_khz(speed)
+            if khz is None:
+                raise ValueError(f"Invalid programmer_speed {speed!r} "
+                                 "(use kHz or a unit, e.g. 4000, '4000k', '4M' or 'auto')")
+            return khz
+        
+        if interface == 'jlink' and self.config.get('target', 'stm32f4') in _FAST_JLINK_TARGETS:
+            return 10000
+        return _DEFAULT_SPEEDS_KHZ.get(interface, 4000)
+    
+    def get_timeout(self, op: str, firmware_file: Optional[Path] = None) -> float:
+        """Get time budget in seconds for op, overridable via config 'timeouts'"""
+        overrides = self.config.get('timeouts', {})
+        if op in overrides:
+            return overrides[op]
+        
+        timeout = _TIMEOUTS[op]
+        if op not in ('erase', 'flash'):
+            return timeout
+        
+        # Mass erase time scales with the part: ~0.1 s per KB (2 MB H7 parts take minutes)
+        flash_kb = _size_kb(self.config.get('flash_size', '512K'))
+        erase_budget = _TIMEOUTS['erase']
+        if flash_kb is not None:
+            erase_budget = max(erase_budget, flash_kb * 0.1 + 10)
+        
+        if op == 'erase':
+            timeout = erase_budget
+        else:
+            if firmware_file is not None:
+                # Allow ~10 KB/s, the slowest rate any supported programmer writes at
+                timeout = max(timeout, firmware_file.stat().st_size / 10000)
+            if self.config.get('erase_before_flash', False):
+                # OpenOCD and J-Link erase inside the flash session
+                timeout += erase_budget
+        return timeout
     
     def check_tool_availability(self, interface: str) -> bool:
         """Check if required programming tool is available"""
         interface_config = self.get_interface_config(interface)
         tool = interface_config['tool']
         
+        tool_path = _tool_path(tool)
+        
+        if tool_path:
+            print(f"Found {tool}: {tool_path}")
+            return True
+        else:
+            print(f"Tool {tool} not found in PATH")
+            return False
+    
+    def _prefetch_probe(self, interface: str):
+        """Background probe; its messages are held until the result is used"""
+        future = self._prefetched[interface]
+        messages: List[str] = []
         try:
-            result = subprocess.run(['which', tool], capture_output=True, text=True)
-            if result.returncode == 0:
-                print(f"Found {tool}: {result.stdout.strip()}")
-                return True
-            else:
-                print(f"Tool {tool} not found in PATH")
-                return False
+            future.set_result((self._run_probe(interface, messages.append), messages))
         except Exception as e:
-            print(f"Error checking tool availability: {e}")
-            return False
+            future.set_exception(e)  # Raised again where the result is used
     
     def probe_target(self, interface: str) -> Dict:
         """Probe for connected target device"""
-        print(f"Probing for target using {interface}...")
+        # Concurrent flashes on one interface share a single probe run
+        with self._probe_lock:
+            prefetched = self._prefetched.pop(interface, None)
+            if prefetched is not None:
+                result, messages = prefetched.result()
+                for message in messages:
+                    print(message)
+                if result['found']:
+                    self._probe_cache[interface] = (time.monotonic(), result)
+                return result
+            
+            cached = self._probe_cache.get(interface)
+            ttl = self.config.get('probe_cache_ttl', 5.0)
+            if cached and time.monotonic() - cached[0] < ttl:
+                return cached[1]
+            
+            result = self._run_probe(interface)
+            if result['found']:
+                self._probe_cache[interface] = (time.monotonic(), result)
+            return result
+    
+    def _run_probe(self, interface: str, log: Callable[[str], None] = print) -> Dict:
+        """Run the interface's probe command"""
+        log(f"Probing for target using {interface}...")
         
         interface_config = self.get_interface_config(interface)
         probe_cmd = interface_config['probe_cmd']
         
         try:
-            result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=10)
+            result = subprocess.run(_resolve(probe_cmd), input=interface_config.get('probe_script'),
+                                    capture_output=True, text=True,
+                                    timeout=self.get_timeout('probe'), **_SPAWN_OPTIONS)
             
             if result.returncode == 0:
-                print("Target device found:")
-                print(result.stdout)
+                log("Target device found:")
+                log(result.stdout)
                 return {
                     'found': True,
+                    'probes': _parse_probes(interface, result.stdout),
                     'output': result.stdout,
                     'error': None
                 }
             else:
-                print("No target device found:")
-                print(result.stderr)
+                log("No target device found:")
+                log(result.stderr)
                 return {
                     'found': False,
+                    'probes': [],
                     'output': result.stdout,
                     'error': result.stderr
                 }
                 
         except subprocess.TimeoutExpired:
-            print("Probe timeout - device may not be connected")
+            log("Probe timeout - device may not be connected")
             return {
                 'found': False,
+                'probes': [],
                 'output': '',
                 'error': 'Timeout'
             }
         except Exception as e:
-            print(f"Error probing target: {e}")
+            log(f"Error probing target: {e}")
             return {
                 'found': False,
+                'probes': [],
                 'output': '',
                 'error': str(e)
             }
     
+    def enumerate_probes(self, interface: str) -> List[str]:
+        """List serial numbers (or serial ports) of all connected probes"""
+        
+        if interface == 'esp32':
+            # ESP32 boards are addressed by their serial port
+            ports = sorted(Path('/dev').glob('ttyUSB*')) + sorted(Path('/dev').glob('ttyACM*'))
+            return [str(port) for port in ports]
+        
+        if interface in ('stlink', 'jlink', 'dfu'):
+            # Same command as the target probe, so share its cached result
+            return [probe['serial'] for probe in self.probe_target(interface)['probes']]
+        
+        if interface == 'openocd':
+            cmd = ['st-info', '--probe']
+        elif interface == 'msp430':
+            cmd = ['mspdebug', '--usb-list']
+        else:
+            print(f"Probe enumeration not implemented for {interface}")
+            return []
+        
+        try:
+            result = subprocess.run(_resolve(cmd), capture_output=True, text=True,
+                                    timeout=self.get_timeout('probe'), **_SPAWN_OPTIONS)
+        except Exception as e:
+            print(f"Error enumerating probes: {e}")
+            return []
+        
+        return [probe['serial'] for probe in _parse_probes(interface, result.stdout)]
+    
     def find_firmware_file(self, file_type: str = 'bin') -> Optional[Path]:
         """Find firmware file in build directory"""
         
-        # Look for firmware files
-        patterns = [
-            f"*.{file_type}",
-            f"firmware.{file_type}",
-            f"main.{file_type}"
-        ]
+        suffix = f".{file_type}"
+        preferred = (f"firmware{suffix}", f"main{suffix}")
         
-        for pattern in patterns:
-            files = list(self.build_dir.glob(pattern))
-            if files:
-                # Return the most recently modified file
-                return max(files, key=lambda f: f.stat().st_mtime)
+        # Single directory pass: newest matching file wins, preferred names break ties
+        best = None
+        best_key = None
+        try:
+            with os.scandir(self.build_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(suffix) or not entry.is_file():
+                        continue
+                    key = (entry.stat().st_mtime, entry.name in preferred)
+                    if best_key is None or key > best_key:
+                        best, best_key = entry.path, key
+        except FileNotFoundError:
+            return None
+        
+        return Path(best) if best else None
+    
+    def _invoke_tool(self, cmd: Sequence[str], op: str, serial: Optional[str] = None,
+                     timeout: Optional[float] = None, script: Optional[str] = None) -> bool:
+        """Run a programming tool command (feeding script on stdin) and report the outcome of op"""
+        if timeout is None:
+            timeout = self.get_timeout(op.lower())
         
-        return None
+        try:
+            returncode, _ = _run_streamed(cmd, f"[{serial}] " if serial else "", timeout, script)
+        except FileNotFoundError:
+            print(f"{op} failed: {cmd[0]} not found")
+            return False
+        except subprocess.TimeoutExpired:
+            print(f"{op} failed: {cmd[0]} timed out after {timeout} seconds")
+            return False
+        except Exception as e:
+            print(f"Error during {op.lower()}: {e}")
+            return False
+        
+        if returncode == 0:
+            print(f"{op} successful!")
+            return True
+        else:
+            print(f"{op} failed (exit code {returncode}): {shlex.join(cmd)}")
+            return False
     
-    def flash_stlink(self, firmware_file: Path) -> bool:
+    def flash_stlink(self, firmware_file: Path, serial: Optional[str] = None) -> bool:
         """Flash using ST-Link interface"""
         print(f"Flashing {firmware_file.name} using ST-Link...")
         
         flash_base = self.config.get('flash_base', '0x08000000')
         
-        cmd = ['st-flash', 'write', str(firmware_file), flash_base]
+        options = (f'--freq={self.get_programmer_speed("stlink")}k',)
+        if self.config.get('connect_under_reset', True):
+            options += ('--connect-under-reset',)
+        if self.config.get('reset_after_flash', True):
+            options += ('--reset',)
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Flash successful!")
-                print(result.stdout)
-                return True
-            else:
-                print("Flash failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during flashing: {e}")
-            return False
+        cmd = ('st-flash', *options, *_select_probe('stlink', serial),
+               'write', str(firmware_file), flash_base)
+        
+        return self._invoke_tool(cmd, 'Flash', serial,
+                                 self.get_timeout('flash', firmware_file))
     
-    def flash_jlink(self, firmware_file: Path) -> bool:
+    def flash_jlink(self, firmware_file: Path, serial: Optional[str] = None) -> bool:
         """Flash using J-Link interface"""
         print(f"Flashing {firmware_file.name} using J-Link...")
         
-        # Create J-Link script
-        script_file = self.build_dir / "flash.jlink"
+        # J-Link Commander reads the script from stdin, so no script file is written
         target = self.config.get('target', 'stm32f4')
         flash_base = self.config.get('flash_base', '0x08000000')
         
+        # Hold nRESET low (r0) while attaching, so a running app can't hold off the debug port
+        connect = "r0\nconnect\nr1\n" if self.config.get('connect_under_reset', True) else ""
+        # Erase and reset run in this session rather than separate J-Link invocations
+        erase = "erase\n" if self.config.get('erase_before_flash', False) else ""
+        reset = "r\n" if self.config.get('reset_after_flash', True) else ""
+        
         jlink_script = f"""
 device {target.upper()}
 si 1
-speed 4000
-r
+speed {self.get_programmer_speed('jlink')}
+{connect}r
 h
-loadfile {firmware_file.absolute()} {flash_base}
-r
-g
+{erase}loadfile {firmware_file.absolute()} {flash_base}
+{reset}g
 exit
 """
         
-        with open(script_file, 'w') as f:
-            f.write(jlink_script)
+        cmd = ('JLinkExe', *_select_probe('jlink', serial))
         
-        cmd = ['JLinkExe', '-CommanderScript', str(script_file)]
-        
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Flash successful!")
-                return True
-            else:
-                print("Flash failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during flashing: {e}")
-            return False
+        return self._invoke_tool(cmd, 'Flash', serial,
+                                 self.get_timeout('flash', firmware_file), script=jlink_script)
     
-    def flash_openocd(self, firmware_file: Path) -> bool:
+    def flash_openocd(self, firmware_file: Path, serial: Optional[str] = None) -> bool:
         """Flash using OpenOCD"""
         print(f"Flashing {firmware_file.name} using OpenOCD...")
         
         target = self.config.get('target', 'stm32f4')
         flash_base = self.config.get('flash_base', '0x08000000')
         
-        # Create OpenOCD config
-        config_file = self.build_dir / "openocd.cfg"
-        
+        select_probe = f"hla_serial {serial}" if serial else ""
+        reset_config = ("reset_config srst_only srst_nogate connect_assert_srst"
+                        if self.config.get('connect_under_reset', True) else "")
+        # Erase and reset run in this session rather than separate OpenOCD invocations.
+        # Dual-bank parts register a flash bank per half, so erase every bank.
+        erase = ("for {set i 0} {$i < [llength [flash list]]} {incr i} {flash erase_sector $i 0 last}"
+                 if self.config.get('erase_before_flash', False) else "")
+        run = "reset run" if self.config.get('reset_after_flash', True) else "resume"
+        
+        # No debugger attaches to a one-shot flash, so skip binding the server ports.
+        # Each line becomes a -c command; no config file is written.
         openocd_config = f"""
+gdb_port disabled
+tcl_port disabled
+telnet_port disabled
 source [find interface/stlink.cfg]
+{select_probe}
 source [find target/{target}x.cfg]
+{reset_config}
+adapter speed {self.get_programmer_speed('openocd')}
 init
 reset halt
+{erase}
 flash write_image erase {firmware_file.absolute()} {flash_base}
-reset run
+{run}
 shutdown
 """
         
-        with open(config_file, 'w') as f:
-            f.write(openocd_config)
-        
-        cmd = ['openocd', '-f', str(config_file)]
+        cmd = ('openocd',) + tuple(arg for line in openocd_config.splitlines() if line
+                                   for arg in ('-c', line))
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Flash successful!")
-                return True
-            else:
-                print("Flash failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during flashing: {e}")
-            return False
+        return self._invoke_tool(cmd, 'Flash', serial,
+                                 self.get_timeout('flash', firmware_file))
     
-    def flash_dfu(self, firmware_file: Path) -> bool:
+    def flash_dfu(self, firmware_file: Path, serial: Optional[str] = None) -> bool:
         """Flash using DFU (Device Firmware Update)"""
         print(f"Flashing {firmware_file.name} using DFU...")
         
         flash_base = self.config.get('flash_base', '0x08000000')
         
-        cmd = [
-            'dfu-util',
-            '-a', '0',
-            '-s', f'{flash_base}:leave',
-            '-D', str(firmware_file)
-        ]
+        cmd = (*_DFU_BASE, '-s', f'{flash_base}:leave', '-D', str(firmware_file),
+               *_select_probe('dfu', serial))
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Flash successful!")
-                print(result.stdout)
-                return True
-            else:
-                print("Flash failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during flashing: {e}")
-            return False
+        return self._invoke_tool(cmd, 'Flash', serial,
+                                 self.get_timeout('flash', firmware_file))
+    
+    def esptool_base(self, serial: Optional[str] = None) -> Tuple[str, ...]:
+        """esptool command selecting the configured chip and port (serial overrides the port)"""
+        target = self.config.get('target', 'esp32')
+        chip = target if target.startswith('esp32') else 'esp32'
+        port = serial or self.config.get('port', '/dev/ttyUSB0')
+        return ('esptool.py', '--chip', chip, '--port', port)
     
-    def flash_esp32(self, firmware_file: Path) -> bool:
-        """Flash ESP32 using esptool"""
+    def flash_esp32(self, firmware_file: Path, serial: Optional[str] = None) -> bool:
+        """Flash ESP32 using esptool (serial is the board's serial port)"""
         print(f"Flashing {firmware_file.name} to ESP32...")
         
-        port = self.config.get('port', '/dev/ttyUSB0')
-        baud = self.config.get('baud', '921600')
+        port = serial or self.config.get('port', '/dev/ttyUSB0')
         
-        cmd = [
-            'esptool.py',
-            '--chip', 'esp32',
-            '--port', port,
-            '--baud', str(baud),
-            'write_flash',
-            '-z',
-            '0x1000', str(firmware_file)
-        ]
+        # ttyACM ports are native USB (S2/S3/C3), which sustain 3 Mbaud
+        default_baud = 3000000 if Path(port).name.startswith('ttyACM') else 921600
+        baud = self.config.get('baud', default_baud)
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Flash successful!")
-                print(result.stdout)
-                return True
-            else:
-                print("Flash failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during flashing: {e}")
-            return False
+        stub = ('--no-stub',) if self.config.get('no_stub', False) else ()
+        after = 'hard_reset' if self.config.get('reset_after_flash', True) else 'no_reset'
+        
+        # esptool's global options must all precede the write_flash command
+        cmd = (*self.esptool_base(serial), '--baud', str(baud), *_ESPTOOL_BEFORE,
+               '--after', after, *stub, *_ESP32_WRITE, str(firmware_file))
+        
+        return self._invoke_tool(cmd, 'Flash', serial,
+                                 self.get_timeout('flash', firmware_file))
     
-    def flash_msp430(self, firmware_file: Path) -> bool:
+    def flash_msp430(self, firmware_file: Path, serial: Optional[str] = None) -> bool:
         """Flash MSP430 using mspdebug"""
         print(f"Flashing {firmware_file.name} to MSP430...")
         
         programmer = self.config.get('programmer', 'rf2500')
         
-        cmd = ['mspdebug', programmer, 'prog', str(firmware_file)]
+        cmd = ('mspdebug', *_select_probe('msp430', serial), programmer, 'prog', str(firmware_file))
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Flash successful!")
-                print(result.stdout)
-                return True
-            else:
-                print("Flash failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during flashing: {e}")
-            return False
+        return self._invoke_tool(cmd, 'Flash', serial,
+                                 self.get_timeout('flash', firmware_file))
     
-    def erase_flash(self, interface: str) -> bool:
+    def erase_flash(self, interface: str, serial: Optional[str] = None) -> bool:
         """Erase target flash memory"""
         print(f"Erasing flash using {interface}...")
         
         interface_config = self.get_interface_config(interface)
+        script = None
         
         if interface == 'stlink':
-            cmd = ['st-flash', 'erase']
+            cmd = ('st-flash', *_select_probe('stlink', serial), 'erase')
         elif interface == 'jlink':
-            # Create J-Link erase script
-            script_file = self.build_dir / "erase.jlink"
+            # J-Link erase script, fed on stdin
             target = self.config.get('target', 'stm32f4')
             
-            jlink_script = f"""
+            script = f"""
 device {target.upper()}
 si 1
-speed 4000
+speed {self.get_programmer_speed('jlink')}
 r
 h
 erase
 exit
 """
-            with open(script_file, 'w') as f:
-                f.write(jlink_script)
-            
-            cmd = ['JLinkExe', '-CommanderScript', str(script_file)]
+            cmd = ('JLinkExe', *_select_probe('jlink', serial))
         elif interface == 'dfu':
             flash_base = self.config.get('flash_base', '0x08000000')
-            cmd = ['dfu-util', '-a', '0', '-s', f'{flash_base}:mass-erase:force']
+            cmd = (*_DFU_BASE, '-s', f'{flash_base}:mass-erase:force',
+                   *_select_probe('dfu', serial))
         elif interface == 'esp32':
-            cmd = ['esptool.py', '--chip', 'esp32', 'erase_flash']
+            cmd = (*self.esptool_base(serial), 'erase_flash')
         else:
             print(f"Erase not implemented for {interface}")
             return False
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Erase successful!")
-                return True
-            else:
-                print("Erase failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during erase: {e}")
-            return False
+        return self._invoke_tool(cmd, 'Erase', serial, script=script)
     
-    def reset_target(self, interface: str) -> bool:
+    def reset_target(self, interface: str, serial: Optional[str] = None) -> bool:
         """Reset target device"""
         print(f"Resetting target using {interface}...")
+        script = None
         
         if interface == 'stlink':
-            cmd = ['st-flash', 'reset']
+            cmd = ('st-flash', *_select_probe('stlink', serial), 'reset')
         elif interface == 'jlink':
-            # Create J-Link reset script
-            script_file = self.build_dir / "reset.jlink"
+            # J-Link reset script, fed on stdin
             target = self.config.get('target', 'stm32f4')
             
-            jlink_script = f"""
+            script = f"""
 device {target.upper()}
 si 1
-speed 4000
+speed {self.get_programmer_speed('jlink')}
 r
 g
 exit
 """
-            with open(script_file, 'w') as f:
-                f.write(jlink_script)
-            
-            cmd = ['JLinkExe', '-CommanderScript', str(script_file)]
+            cmd = ('JLinkExe', *_select_probe('jlink', serial))
         elif interface == 'esp32':
-            cmd = ['esptool.py', '--chip', 'esp32', 'run']
+            cmd = (*self.esptool_base(serial), 'run')
         else:
             print(f"Reset not implemented for {interface}")
             return False
         
+        return self._invoke_tool(cmd, 'Reset', serial, script=script)
+    
+    def flash_marker_path(self, interface: str, probe_id: str) -> Path:
+        """Get path of the record of what was last flashed through this probe"""
+        probe = re.sub(r'[^A-Za-z0-9]+', '_', probe_id).strip('_')
+        return self.build_dir / f".last_flashed_{interface}_{probe}.json"
+    
+    def is_already_flashed(self, interface: str, firmware_hash: str, probe_id: str) -> bool:
+        """Check whether this exact image was the last one flashed through the probe"""
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print("Reset successful!")
-                return True
-            else:
-                print("Reset failed:")
-                print(result.stderr)
-                return False
-                
-        except Exception as e:
-            print(f"Error during reset: {e}")
+            with open(self.flash_marker_path(interface, probe_id), 'r') as f:
+                return json.load(f).get('sha256') == firmware_hash
+        except (OSError, ValueError):
             return False
     
+    def record_flashed(self, interface: str, firmware_file: Path, firmware_hash: str,
+                       probe_id: str):
+        """Remember the image just flashed through the probe"""
+        marker = self.flash_marker_path(interface, probe_id)
+        try:
+            marker.parent.mkdir(exist_ok=True)
+            with open(marker, 'w') as f:
+                json.dump({
+                    'sha256': firmware_hash,
+                    'firmware_file': str(firmware_file),
+                    'flashed_at': time.time()
+                }, f)
+        except OSError as e:
+            print(f"Warning: could not record flashed image: {e}")
+    
     def flash(self, interface: str, firmware_file: Optional[Path] = None, 
-              file_type: str = 'bin') -> Dict:
-        """Perform complete flash operation"""
+              file_type: str = 'bin', serial: Optional[str] = None) -> Dict:
+        """Perform complete flash operation (on one probe if serial is given)"""
         
         start_time = time.time()
-        print(f"Starting flash operation using {interface}")
+        print(f"Starting flash operation using {interface}" +
+              (f" (probe {serial})" if serial else ""))
         
         try:
             # Check tool availability
@@ -506,9 +805,44 @@ exit
                     'flash_time': 0
                 }
             
-            # Erase if requested
-            if self.config.get('erase_before_flash', False):
-                if not self.erase_flash(interface):
+            # One probe run lists every stlink/jlink/dfu device; check this one is among them
+            if serial and interface in ('stlink', 'jlink', 'dfu'):
+                if serial not in {probe['serial'] for probe in probe_result['probes']}:
+                    return {
+                        'success': False,
+                        'error': f'Probe {serial} not found',
+                        'flash_time': 0
+                    }
+            
+            # Identify the probe: explicit serial, the port esptool writes to, else the
+            # only probe attached
+            probe_id = serial
+            if probe_id is None and interface == 'esp32':
+                probe_id = self.config.get('port', '/dev/ttyUSB0')
+            elif probe_id is None and len(probe_result['probes']) == 1:
+                probe_id = probe_result['probes'][0]['serial']
+            
+            # Opt-in: skip the cycle when this project last sent the same image through
+            # this probe. The marker doesn't prove what the target holds now (another
+            # project or a swapped target invalidates it), hence off by default.
+            # An explicit erase always reprograms.
+            firmware_hash = _file_sha256(firmware_file)
+            if (probe_id and self.config.get('skip_if_unchanged', False) and
+                    not self.config.get('force_flash', False) and
+                    not self.config.get('erase_before_flash', False) and
+                    self.is_already_flashed(interface, firmware_hash, probe_id)):
+                print("Image unchanged since last flash through this probe, skipping "
+                      "(use --force to reflash)")
+                return {
+                    'success': True,
+                    'cached': True,
+                    'firmware_file': str(firmware_file),
+                    'flash_time': time.time() - start_time
+                }
+            
+            # Erase if requested (and not already done by the write)
+            if self.config.get('erase_before_flash', False) and not _ERASE_INTEGRATED.get(interface):
+                if not self.erase_flash(interface, serial):
                     return {
                         'success': False,
                         'error': 'Flash erase failed',
@@ -533,16 +867,21 @@ exit
                     'flash_time': 0
                 }
             
-            if not flash_func(firmware_file):
+            if not flash_func(firmware_file, serial):
+                # The target may have gone away; probe again next time
+                self._probe_cache.pop(interface, None)
                 return {
                     'success': False,
                     'error': 'Flash operation failed',
                     'flash_time': time.time() - start_time
                 }
             
+            if probe_id:
+                self.record_flashed(interface, firmware_file, firmware_hash, probe_id)
+            
             # Reset if requested
-            if self.config.get('reset_after_flash', True):
-                self.reset_target(interface)
+            if self.config.get('reset_after_flash', True) and interface not in _RESET_INTEGRATED:
+                self.reset_target(interface, serial)
             
             flash_time = time.time() - start_time
             print(f"\nFlash completed successfully in {flash_time:.2f} seconds")
@@ -559,6 +898,24 @@ exit
                 'error': str(e),
                 'flash_time': time.time() - start_time
             }
+    
+    def flash_all(self, interface: str, firmware_file: Optional[Path] = None,
+                  file_type: str = 'bin') -> Dict[str, Dict]:
+        """Flash every connected probe concurrently, returning results by serial"""
+        probes = self.enumerate_probes(interface)
+        if not probes:
+            print(f"No probes found for {interface}")
+            return {}
+        
+        print(f"Flashing {len(probes)} devices using {interface}")
+        
+        # Each flash mostly waits on its programming tool, so threads overlap well
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            futures = {
+                serial: executor.submit(self.flash, interface, firmware_file, file_type, serial)
+                for serial in probes
+            }
+            return {serial: future.result() for serial, future in futures.items()}
 
 
 def main():
@@ -579,12 +936,20 @@ def main():
                        help='Do not reset target after flashing')
     parser.add_argument('--probe-only', action='store_true',
                        help='Only probe for target, do not flash')
+    parser.add_argument('--serial', '-s', type=str,
+                       help='Serial number (or port for esp32) of the probe to use')
+    parser.add_argument('--all', action='store_true',
+                       help='Flash all connected probes concurrently')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                       help='Skip flashing if this image was the last one flashed through the probe')
+    parser.add_argument('--force', action='store_true',
+                       help='Flash even if skip_if_unchanged is set and the image is unchanged')
     
     args = parser.parse_args()
     
     # Create flasher
     try:
-        flasher = QKFlasher(args.project)
+        flasher = QKFlasher(args.project, args.interface)
     except Exception as e:
         print(f"Error initializing flasher: {e}")
         sys.exit(1)
@@ -594,6 +959,10 @@ def main():
         flasher.config['erase_before_flash'] = True
     if args.no_reset:
         flasher.config['reset_after_flash'] = False
+    if args.skip_unchanged:
+        flasher.config['skip_if_unchanged'] = True
+    if args.force:
+        flasher.config['force_flash'] = True
     
     # Probe only if requested
     if args.probe_only:
@@ -602,7 +971,15 @@ def main():
     
     # Flash firmware
     firmware_file = Path(args.file) if args.file else None
-    result = flasher.flash(args.interface, firmware_file, args.type)
+    
+    if args.all:
+        results = flasher.flash_all(args.interface, firmware_file, args.type)
+        failed = [serial for serial, result in results.items() if not result['success']]
+        for serial in failed:
+            print(f"Flash failed on {serial}: {results[serial]['error']}")
+        sys.exit(1 if failed or not results else 0)
+    
+    result = flasher.flash(args.interface, firmware_file, args.type, args.serial)
     
     if not result['success']:
         print(f"Flash failed: {result['error']}")